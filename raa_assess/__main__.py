@@ -15,6 +15,8 @@ import numpy as np
 from . import draw
 from . import utils as ul
 from . import compute as cp
+from . import workq as wq
+from . import store as st
 
 
 def sub_view(args):
@@ -26,8 +28,7 @@ def sub_view(args):
         info = f"type{tpi:<3}{size:<3}{cluster:<40}{method}"
         print(info)
     
-def sub_reduce(args):
-    tpi, size = args.t, args.s
+def query_cluster(tpi, size):
     if "-" in tpi[0]:
         ss = tpi[0].split("-")
         tpi = [i for i in range(int(ss[0]), int(ss[1])+1)]
@@ -36,49 +37,145 @@ def sub_reduce(args):
         size = [i for i in range(int(ss[0]), int(ss[1])+1)]
     type_id = ','.join(map(str, tpi))
     size = ','.join(map(str, size))
-    cluster_info = ul.reduce_query(type_id, size)
+    return ul.reduce_query(type_id, size)
+
+def sub_reduce(args):
+    cluster_info = query_cluster(args.t, args.s)
     for n in args.k:
-        ul.reduce_seq(args.f, f'{args.o}_{n}n', n, cluster_info, args.p)
+        ul.reduce_seq(args.f, f'{args.o}_{n}n', n, cluster_info, args.p, incremental=args.inc,
+                      dedup=args.dedup)
+
+def save_store(json_path, db, n, args):
+    with open(json_path, 'r') as f:
+        re_dic = json.load(f)
+    hpo = 1 if args.hpo is None else args.hpo
+    st.save(db, re_dic, n, run=args.run, classifier=args.clf, cv=cp.cv_mode(args.cv, args.rep),
+            hpo=hpo)
 
 def sub_eval(args):
     ul.mkdirs(args.input)
+    args.run = args.run if args.run else st.new_run()
     for n in args.k:
         folder_name = f'{args.input}_{n}n'
         json_path = os.path.join(args.input, f'{n}n_result.json')
-        cp.all_eval(folder_name, json_path, n, args.cv, args.hpo, args.p)
+        if args.adaptive:
+            cp.adaptive_eval(folder_name, json_path, n, args.cv, args.hpo, args.p,
+                             rounds=args.rounds, keep=args.keep, model=args.clf,
+                             dedup=args.dedup, repeat=args.rep)
+        else:
+            cp.all_eval(folder_name, json_path, n, args.cv, args.hpo, args.p, model=args.clf,
+                        dedup=args.dedup, repeat=args.rep)
+        save_store(json_path, os.path.join(args.input, 'result.db'), n, args)
         if args.v:
             with open(json_path, 'r') as f:
                 re_dic = json.load(f)
             ul.eval_plot(re_dic, n, args.input, fmt=args.fmt)
 
+def sub_run(args):
+    ul.mkdirs(args.o)
+    args.run = args.run if args.run else st.new_run()
+    cluster_info = query_cluster(args.t, args.s)
+    for n in args.k:
+        folder_name = f'{args.o}_{n}n'
+        json_path = os.path.join(args.o, f'{n}n_result.json')
+        cp.pipeline_eval(args.f, folder_name, json_path, n, cluster_info,
+                         args.cv, args.hpo, args.p, model=args.clf, dedup=args.dedup,
+                         repeat=args.rep)
+        save_store(json_path, os.path.join(args.o, 'result.db'), n, args)
+        if args.v:
+            with open(json_path, 'r') as f:
+                re_dic = json.load(f)
+            ul.eval_plot(re_dic, n, args.o, fmt=args.fmt)
+
 def sub_plot(args):
     ul.mkdirs(args.o)
+    if args.db:
+        if not args.k:
+            raise ValueError('-k is required with -db')
+        for n in args.k:
+            all_score, filter_score = st.load_scores(args.db, n, run=args.run, filter_num=8,
+                                                     classifier=args.clf)
+            ul.score_plot(all_score, filter_score, n, args.o, fmt=args.fmt)
+        return
     for re_file in args.f:
         with open(re_file, 'r') as f:
             re_dic = json.load(f)
         n = os.path.basename(re_file).split("_")[0][0]
         ul.eval_plot(re_dic, int(n), args.o, fmt=args.fmt)
 
+def sub_top(args):
+    for item in st.top(args.db, n=args.n, key=args.key, k=args.k, run=args.run):
+        run, k, tpi, size, clf, cv, score = item
+        tpi = f"type{tpi}" if tpi else "naa"
+        print(f"{run:<18}{k}n {tpi:<8}{size:<4}{clf:<6}{cv:<9}{score:.4f}")
+
 def sub_fs(args):
     ul.mkdirs(args.o)
     if args.mix:
-        acc_ls = cp.feature_mix(args.f, cv=args.cv, hpo=args.hpo)
+        acc_ls = cp.feature_mix(args.f, cv=args.cv, hpo=args.hpo, model=args.clf,
+                                dedup=args.dedup, repeat=args.rep)
         filename = f'mix_feature.{args.fmt}'
         fig_path = os.path.join(args.o, filename)
         draw.p_fs(acc_ls, out=fig_path)
     else:
         for file in args.f: 
-            acc_ls = cp.feature_select(file, cv=args.cv, hpo=args.hpo)
+            acc_ls = cp.feature_select(file, cv=args.cv, hpo=args.hpo, model=args.clf,
+                                       dedup=args.dedup, repeat=args.rep)
             filename = file.split('.')[0].split(os.sep)[-1] + f'.{args.fmt}'
             fig_path = os.path.join(args.o, filename)
             draw.p_fs(acc_ls, out=fig_path)
 
+def sub_queue(args):
+    if args.f:
+        cluster_info = query_cluster(args.t, args.s)
+        cv = -1 if args.cv is None else args.cv
+        hpo = 1 if args.hpo is None else args.hpo
+        job, counts = wq.submit(args.db, args.f, args.o, args.k, cluster_info,
+                           evaluate=args.eval, cv=cv, hpo=hpo, model=args.clf,
+                           dedup=args.dedup, repeat=args.rep)
+        print(f'{counts} tasks have been submitted as job {job}!')
+    if args.collect:
+        conn = wq.connect(args.db)
+        for job in wq.jobs(conn):
+            if wq.get_meta(conn, job)['evaluate']:
+                wq.collect(conn, job)
+        conn.close()
+    for job, stage, state, counts in wq.status(args.db):
+        print(f"{job:<6}{stage:<8}{state:<9}{counts}")
+
+def sub_worker(args):
+    wq.run_worker(args.db, interval=args.hb, timeout=args.timeout)
+
+def sub_search(args):
+    ul.mkdirs(args.o)
+    for n in args.k:
+        rows = cp.merge_search(args.f, n, args.cv, args.hpo, args.p, beam=args.beam,
+                               min_size=args.min, model=args.clf, proxy=args.proxy,
+                               repeat=args.rep)
+        with open(os.path.join(args.o, f'search_{n}n.txt'), 'w') as f:
+            for tpi, size, cluster, method in rows:
+                f.write(f"{tpi}\t{size}\t{cluster}\t{method}\n")
+
+def sub_compare(args):
+    ul.mkdirs(args.o)
+    for file in args.f:
+        result_dic = cp.al_comparison(file, cv=args.cv, cpu=args.p, model=args.clf)
+        name = file.split('.')[0].split(os.sep)[-1]
+        draw.p_roc_al(result_dic, os.path.join(args.o, f'{name}_roc.{args.fmt}'))
+        acc, sn, sp, ppv, mcc, auc = "acc", "sn", "sp", "ppv", "mcc", "auc"
+        print(f"{name:<6}{acc:<7}{sn:<7}{sp:<7}{ppv:<7}{mcc:<7}{auc:<7}")
+        for clf, (_, _, acc, sn, sp, ppv, mcc, auc) in result_dic.items():
+            print(f"{clf:<6}{acc[0]:<7.4f}{sn[0]:<7.4f}{sp[0]:<7.4f}"
+                  f"{ppv[0]:<7.4f}{mcc[0]:<7.4f}{auc:<7.4f}")
+
 def sub_own(args):
     ul.mkdirs(args.o)
     for n in args.k:
         cluster = args.cluster.split("-")
         feature_file_path = os.path.join(args.o, f"{len(cluster)}_{n}n.csv")
-        metric, cm = cp.own_func(args.f, feature_file_path, cluster, n)
+        metric, cm = cp.own_func(args.f, feature_file_path, cluster, n, cv=args.cv,
+                                 hpo=args.hpo, model=args.clf, dedup=args.dedup,
+                                 repeat=args.rep, cpu=args.p)
         report_file = os.path.join(args.o, f"{n}n_report.txt")
         ul.print_report(metric, cm, report_file)
     
@@ -133,6 +230,10 @@ def command_parser():
     parser_a.add_argument('-o', help='output folder name')
     parser_a.add_argument('-p', type=int, choices=list([i for i in range(1, os.cpu_count())]),
                                  default=os.cpu_count()/2, help='output folder name')
+    parser_a.add_argument('-inc', action='store_true',
+                                 help='only update records changed since the last run')
+    parser_a.add_argument('-dedup', action='store_true',
+                                 help='process duplicated sequences once')
     parser_a.set_defaults(func=sub_reduce)
 
     parser_c = subparsers.add_parser('eval', help='evaluate models')
@@ -140,27 +241,89 @@ def command_parser():
     parser_c.add_argument('-k', nargs='+', type=int, choices=[1,2,3], help='feature extract method')
     parser_c.add_argument('-cv', type=float, help='cross validation fold')
     parser_c.add_argument('-hpo', type=float, help='hyper-parameter optimize,')
+    parser_c.add_argument('-rep', type=int, default=1,
+                                 help='repeats of k-fold cross validation')
+    parser_c.add_argument('-clf', default='svm', choices=['svm', 'asvm'],
+                                 help='svm or approximate kernel svm for large dataset')
     parser_c.add_argument('-v', action='store_true', help='if visual')
+    parser_c.add_argument('-run', help='run name in the result store, default is the time')
+    parser_c.add_argument('-adaptive', action='store_true',
+                                 help='prune schemes with cheap proxy rounds first')
+    parser_c.add_argument('-rounds', type=int, default=2, help='proxy rounds of -adaptive')
+    parser_c.add_argument('-keep', type=float, default=0.3,
+                                 help='fraction of schemes promoted each round')
     parser_c.add_argument('-fmt', default="png", help='the format of figures')
     parser_c.add_argument('-p', type=int, choices=list([i for i in range(1, os.cpu_count())]),
                                  default=os.cpu_count()/2, help='output folder name')
+    parser_c.add_argument('-dedup', action='store_true',
+                                 help='process duplicated sequences once')
     parser_c.set_defaults(func=sub_eval)
     
+    parser_r = subparsers.add_parser('run', help='reduce sequence and evaluate models in a pipeline')
+    parser_r.add_argument('-f', nargs='+', help='fasta files')
+    parser_r.add_argument('-k', nargs='+', type=int, choices=[1,2,3], help='feature extract method')
+    parser_r.add_argument('-t', nargs='+', help='type id')
+    parser_r.add_argument('-s', nargs='+', help='reduce size')
+    parser_r.add_argument('-o', help='output folder name')
+    parser_r.add_argument('-cv', type=float, help='cross validation fold')
+    parser_r.add_argument('-hpo', type=float, help='hyper-parameter optimize,')
+    parser_r.add_argument('-rep', type=int, default=1,
+                                 help='repeats of k-fold cross validation')
+    parser_r.add_argument('-clf', default='svm', choices=['svm', 'asvm'],
+                                 help='svm or approximate kernel svm for large dataset')
+    parser_r.add_argument('-v', action='store_true', help='if visual')
+    parser_r.add_argument('-run', help='run name in the result store, default is the time')
+    parser_r.add_argument('-fmt', default="png", help='the format of figures')
+    parser_r.add_argument('-p', type=int, choices=list([i for i in range(1, os.cpu_count())]),
+                                 default=os.cpu_count()/2, help='cpu core number')
+    parser_r.add_argument('-dedup', action='store_true',
+                                 help='process duplicated sequences once')
+    parser_r.set_defaults(func=sub_run)
+
     parser_d = subparsers.add_parser("plot", help='analyze and plot evaluate result')
     parser_d.add_argument('-f', nargs='+', help='the result json file')
+    parser_d.add_argument('-db', help='the result store, instead of -f')
+    parser_d.add_argument('-k', nargs='+', type=int, choices=[1,2,3], help='k of -db')
+    parser_d.add_argument('-run', help='run name of -db, default is the latest')
+    parser_d.add_argument('-clf', default='svm', help='classifier of -db')
     parser_d.add_argument('-fmt', default="png", help='the format of figures')
     parser_d.add_argument('-o', help='output folder')
     parser_d.set_defaults(func=sub_plot)
 
+    parser_t = subparsers.add_parser("top", help='query the best results of the result store')
+    parser_t.add_argument('-db', help='the result store')
+    parser_t.add_argument('-n', type=int, default=10, help='number of results')
+    parser_t.add_argument('-key', default='acc', choices=st.METRICS, help='metric to sort by')
+    parser_t.add_argument('-k', type=int, choices=[1,2,3], help='feature extract method')
+    parser_t.add_argument('-run', help='run name')
+    parser_t.set_defaults(func=sub_top)
+
     parser_e = subparsers.add_parser("fs", help='analyze and plot evaluate result')
     parser_e.add_argument('-f', nargs='+', help='feature file')
     parser_e.add_argument('-o', help='output folder')
     parser_e.add_argument('-cv', type=float, help='cross validation fold')
     parser_e.add_argument('-hpo', type=float, help='hyper-parameter optimize,')
+    parser_e.add_argument('-rep', type=int, default=1,
+                                 help='repeats of k-fold cross validation')
+    parser_e.add_argument('-clf', default='svm', choices=['svm', 'asvm'],
+                                 help='svm or approximate kernel svm for large dataset')
     parser_e.add_argument('-fmt', default="png", help='the format of figures')
     parser_e.add_argument('-mix', action='store_true', help='feature mix')
+    parser_e.add_argument('-dedup', action='store_true',
+                                 help='process duplicated sequences once')
     parser_e.set_defaults(func=sub_fs)
     
+    parser_m = subparsers.add_parser("compare", help='compare SVM, RF and KNN on a feature file')
+    parser_m.add_argument('-f', nargs='+', help='feature file')
+    parser_m.add_argument('-o', help='output folder')
+    parser_m.add_argument('-cv', type=int, default=5, help='cross validation fold')
+    parser_m.add_argument('-clf', default='svm', choices=['svm', 'asvm'],
+                                 help='svm or approximate kernel svm for large dataset')
+    parser_m.add_argument('-fmt', default="png", help='the format of figures')
+    parser_m.add_argument('-p', type=int, choices=list([i for i in range(1, os.cpu_count())]),
+                                 default=os.cpu_count()/2, help='cpu core number')
+    parser_m.set_defaults(func=sub_compare)
+
     parser_f = subparsers.add_parser("own", help='use your own raa')
     parser_f.add_argument('-f', nargs='+', help='fasta files')
     parser_f.add_argument('-cluster', help='fasta files')
@@ -168,8 +331,59 @@ def command_parser():
     parser_f.add_argument('-o', help='output folder')
     parser_f.add_argument('-cv', type=float, help='cross validation fold')
     parser_f.add_argument('-hpo', type=float, help='hyper-parameter optimize,')
+    parser_f.add_argument('-rep', type=int, default=1,
+                                 help='repeats of k-fold cross validation')
+    parser_f.add_argument('-clf', default='svm', choices=['svm', 'asvm'],
+                                 help='svm or approximate kernel svm for large dataset')
+    parser_f.add_argument('-dedup', action='store_true',
+                                 help='process duplicated sequences once')
+    parser_f.add_argument('-p', type=int, choices=list([i for i in range(1, os.cpu_count())]),
+                                 default=os.cpu_count()/2, help='cpu core number')
     parser_f.set_defaults(func=sub_own) 
     
+    parser_s = subparsers.add_parser("search", help='search raa by merging clusters of 20 amino acids')
+    parser_s.add_argument('-f', nargs='+', help='fasta files')
+    parser_s.add_argument('-k', nargs='+', type=int, choices=[1,2,3], help='feature extract method')
+    parser_s.add_argument('-o', help='output folder')
+    parser_s.add_argument('-beam', type=int, default=1, help='partitions kept at each size')
+    parser_s.add_argument('-min', type=int, default=2, help='smallest size to search')
+    parser_s.add_argument('-proxy', action='store_true', help='score candidates with a linear svm')
+    parser_s.add_argument('-cv', type=float, help='cross validation fold')
+    parser_s.add_argument('-hpo', type=float, help='hyper-parameter optimize,')
+    parser_s.add_argument('-rep', type=int, default=1,
+                                 help='repeats of k-fold cross validation')
+    parser_s.add_argument('-clf', default='svm', choices=['svm', 'asvm'],
+                                 help='svm or approximate kernel svm for large dataset')
+    parser_s.add_argument('-p', type=int, choices=list([i for i in range(1, os.cpu_count())]),
+                                 default=os.cpu_count()/2, help='cpu core number')
+    parser_s.set_defaults(func=sub_search)
+
+    parser_q = subparsers.add_parser("queue", help='submit tasks to a shared work queue')
+    parser_q.add_argument('-db', help='queue database on the shared filesystem')
+    parser_q.add_argument('-f', nargs='+', help='fasta files')
+    parser_q.add_argument('-k', nargs='+', type=int, choices=[1,2,3], help='feature extract method')
+    parser_q.add_argument('-t', nargs='+', help='type id')
+    parser_q.add_argument('-s', nargs='+', help='reduce size')
+    parser_q.add_argument('-o', help='output folder name')
+    parser_q.add_argument('-eval', action='store_true', help='evaluate every reduced scheme')
+    parser_q.add_argument('-cv', type=float, help='cross validation fold')
+    parser_q.add_argument('-hpo', type=float, help='hyper-parameter optimize,')
+    parser_q.add_argument('-rep', type=int, default=1,
+                                 help='repeats of k-fold cross validation')
+    parser_q.add_argument('-clf', default='svm', choices=['svm', 'asvm'],
+                                 help='svm or approximate kernel svm for large dataset')
+    parser_q.add_argument('-collect', action='store_true', help='write the result json files')
+    parser_q.add_argument('-dedup', action='store_true',
+                                 help='process duplicated sequences once')
+    parser_q.set_defaults(func=sub_queue)
+
+    parser_w = subparsers.add_parser("worker", help='run tasks of a shared work queue')
+    parser_w.add_argument('-db', help='queue database on the shared filesystem')
+    parser_w.add_argument('-hb', type=int, default=30, help='heartbeat interval (s)')
+    parser_w.add_argument('-timeout', type=int, default=300,
+                                 help='requeue tasks without heartbeat for timeout (s)')
+    parser_w.set_defaults(func=sub_worker)
+
     args = parser.parse_args()
     
     try:
@@ -6,65 +6,125 @@
 
 """
 
+from concurrent import futures
+
 import numpy as np
-from sklearn.svm import SVC
+from sklearn.base import clone
+from sklearn.svm import SVC, LinearSVC
+from sklearn.linear_model import SGDClassifier
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.calibration import CalibratedClassifierCV
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import GridSearchCV, train_test_split, LeaveOneOut
 from sklearn.preprocessing import Normalizer, LabelEncoder
 from sklearn.metrics import multilabel_confusion_matrix
-from sklearn.model_selection import StratifiedKFold
+from sklearn.model_selection import StratifiedKFold, RepeatedStratifiedKFold
 from sklearn.pipeline import Pipeline
 
 
+def fit(clf, x, y, sample_weight=None):
+    """ fit a classifier or a pipeline, with sample weight if given """
+    if sample_weight is None:
+        return clf.fit(x, y)
+    if isinstance(clf, Pipeline):
+        return clf.fit(x, y, **{f'{clf.steps[-1][0]}__sample_weight': sample_weight})
+    return clf.fit(x, y, sample_weight=sample_weight)
+
+
+def calibrate(clf, x, y, sample_weight=None):
+    """ Platt scaling of the last step, fitted with the sample weight """
+    if isinstance(clf, Pipeline):
+        name, last = clf.steps[-1]
+        clf = Pipeline(clf.steps[:-1] + [(name, CalibratedClassifierCV(last, cv=3, ensemble=False))])
+    else:
+        clf = CalibratedClassifierCV(clf, cv=3, ensemble=False)
+    return fit(clf, x, y, sample_weight)
+
+
+def grid_fit(grid, x_train, y_train, sample_weight=None):
+    """ grid search on 60% of the training data """
+    if sample_weight is None:
+        x_train, _, y_train, _ = train_test_split(x_train, y_train, test_size=0.4, random_state=1, shuffle=True)  #
+        return grid.fit(x_train, y_train)
+    x_train, _, y_train, _, w_train, _ = train_test_split(
+        x_train, y_train, sample_weight, test_size=0.4, random_state=1, shuffle=True)
+    return grid.fit(x_train, y_train, classify__sample_weight=w_train)
+
+
 class Evaluate:
-    def __init__(self, model, x, y):
+    def __init__(self, model, x, y, weight=None, n_jobs=1):
         self.model = model
         self.x = x
         self.y = y
+        self.weight = weight
+        self.n_jobs = n_jobs
 
     def loo(self):
         lo = LeaveOneOut()
-        clf = self.model
-        X, y = self.x, self.y        
-        ss = lo.split(X)
-        y_pre_arr = np.zeros(len(y))
-        for train_idx, test_idx in ss:
-            x_train, y_train = X[train_idx], y[train_idx]
-            x_test, y_test = X[test_idx], y[test_idx]
-            fit_clf = clf.fit(x_train, y_train)
-            y_true, y_pre = y_test, fit_clf.predict(x_test)
-            y_pre_arr[test_idx] = y_pre
-        metric = self.metrics_(y, y_pre_arr)
-        cm = multilabel_confusion_matrix(y, y_pre_arr)
+        X, y, w = self.x, self.y, self.weight
+        test_ls = [test_idx for _, test_idx in lo.split(X)]
+        y_pre_arr = self.cross_predict(test_ls)
+        metric = self.metrics_(y, y_pre_arr, w)
+        cm = multilabel_confusion_matrix(y, y_pre_arr, sample_weight=w)
         return metric, cm
     
-    def kfold(self, k):
-        skf = StratifiedKFold(n_splits=k, random_state=1)
-        ss = skf.split(self.x, self.y)
-        clf = self.model
-        all_metrics = 0
-        X, y = self.x, self.y
-        for train_idx, test_idx in ss:
-            x_train, y_train = X[train_idx], y[train_idx]
-            x_test, y_test = X[test_idx], y[test_idx]
-            fit_clf = clf.fit(x_train, y_train)
-            y_true, y_pre = y_test, fit_clf.predict(x_test)
-            metric = self.metrics_(y_true, y_pre) # sn, sp, presision, acc, mcc, fpr, tpr,
-            all_metrics = np.add(all_metrics, metric)
-        k_mean_metric = all_metrics / k
-        return k_mean_metric
+    def kfold(self, k, repeat=1):
+        """ stratified k-fold, repeated with different shuffles if repeat > 1,
+        metrics and confusion matrix are pooled over the out-of-fold
+        predictions of every repeat
+        """
+        if repeat > 1:
+            skf = RepeatedStratifiedKFold(n_splits=k, n_repeats=repeat, random_state=1)
+        else:
+            skf = StratifiedKFold(n_splits=k, shuffle=True, random_state=1)
+        test_ls = [test_idx for _, test_idx in skf.split(self.x, self.y)]
+        y_pre_ls = [self.cross_predict(test_ls[i:i+k]) for i in range(0, len(test_ls), k)]
+        y_true, y_pre = np.tile(self.y, repeat), np.concatenate(y_pre_ls)
+        w = None if self.weight is None else np.tile(self.weight, repeat)
+        metric = self.metrics_(y_true, y_pre, w)
+        cm = multilabel_confusion_matrix(y_true, y_pre, sample_weight=w)
+        return metric, cm
+
+    def cross_predict(self, test_ls):
+        """ out-of-fold predictions, the folds are split among n_jobs threads,
+        libsvm and liblinear release the GIL while fitting
+        """
+        y_pre_arr = np.zeros(len(self.y))
+        chunk = int(np.ceil(len(test_ls) / self.n_jobs))
+        with futures.ThreadPoolExecutor(self.n_jobs) as tpe:
+            to_do = [tpe.submit(self._fold_predict, test_ls[i:i+chunk])
+                     for i in range(0, len(test_ls), chunk)]
+            for it in futures.as_completed(to_do):
+                for test_idx, y_pre in it.result():
+                    y_pre_arr[test_idx] = y_pre
+        return y_pre_arr
+
+    def _fold_predict(self, test_ls):
+        X, y, w = self.x, self.y, self.weight
+        result = []
+        for test_idx in test_ls:
+            train_mask = np.ones(len(y), dtype=bool)
+            train_mask[test_idx] = False
+            w_train = None if w is None else w[train_mask]
+            fit_clf = fit(clone(self.model), X[train_mask], y[train_mask], w_train)
+            result.append((test_idx, fit_clf.predict(X[test_idx])))
+        return result
 
     def holdout(self, test_size):
-        x_train, x_test, y_train, y_test = train_test_split(self.x, self.y, shuffle=True,
-                                                random_state=1, test_size=test_size)
-        fit_clf = self.model.fit(x_train, y_train)
+        w = np.ones(len(self.y)) if self.weight is None else self.weight
+        x_train, x_test, y_train, y_test, w_train, w_test = train_test_split(
+            self.x, self.y, w, shuffle=True, random_state=1, test_size=test_size,
+            stratify=self.y)
+        if self.weight is None:
+            w_train, w_test = None, None
+        fit_clf = fit(self.model, x_train, y_train, w_train)
         y_true, y_pre = y_test, fit_clf.predict(x_test)
-        metric = self.metrics_(y_true, y_pre)
-        cm = multilabel_confusion_matrix(y_true, y_pre)
+        metric = self.metrics_(y_true, y_pre, w_test)
+        cm = multilabel_confusion_matrix(y_true, y_pre, sample_weight=w_test)
         return metric, cm
 
-    def metrics_(self, y_true, y_pre):
+    def metrics_(self, y_true, y_pre, weight=None):
         le = LabelEncoder()
         y_true, y_pre = y_true.ravel(), y_pre.ravel()
         unique_label = np.unique(y_true)
@@ -72,7 +132,7 @@ class Evaluate:
         idx_label = le.transform(unique_label)
         y_true = le.transform(y_true)
         y_pre = le.transform(y_pre)
-        mcm = multilabel_confusion_matrix(y_true, y_pre, labels=idx_label)
+        mcm = multilabel_confusion_matrix(y_true, y_pre, labels=idx_label, sample_weight=weight)
         tn = mcm[:, 0, 0]
         tp = mcm[:, 1, 1]
         fn = mcm[:, 1, 0]
@@ -88,11 +148,14 @@ class Evaluate:
 class SvmClassifier:
 
     def __init__(self, param_grid=None, kernel='rbf', C=1, gamma=0.1, cv=5,
-                 grid_search=True, ):
+                 grid_search=True, probability=False, n_jobs=-1):
         self.cv = cv
+        self.n_jobs = n_jobs
         self.param_grid = param_grid if param_grid else {}
         self.is_grid_search = grid_search
-        self.clf = SVC(class_weight='balanced', probability=True,)  # cache_size=500
+        # Platt scaling adds an internal 3-fold fit, only pay for it when asked
+        self.probability = probability
+        self.clf = SVC(class_weight='balanced')  # cache_size=500
         if self.is_grid_search:
             self._check_param_grid(self.param_grid)
         else:
@@ -100,20 +163,21 @@ class SvmClassifier:
             self.gamma = gamma
             self.kernel = kernel
 
-    def train(self, x_train, y_train):
+    def train(self, x_train, y_train, sample_weight=None):
         if self.is_grid_search:
-            svm = self.grid_search(x_train, y_train)
+            svm = self.grid_search(x_train, y_train, sample_weight)
         else:
-            svm = self.clf.fit(x_train, y_train)
+            svm = fit(self.clf, x_train, y_train, sample_weight)
+        if self.probability:
+            svm = calibrate(svm, x_train, y_train, sample_weight)
         return svm
 
-    def grid_search(self, x_train, y_train):
+    def grid_search(self, x_train, y_train, sample_weight=None):
         pipe = Pipeline([
             ('classify', self.clf)
         ])
-        grid = GridSearchCV(pipe, cv=5, n_jobs=-1, param_grid=self.param_grid, iid=True)
-        x_train, _, y_train, _ = train_test_split(x_train, y_train, test_size=0.4, random_state=1, shuffle=True)  #
-        clf = grid.fit(x_train, y_train)
+        grid = GridSearchCV(pipe, cv=5, n_jobs=self.n_jobs, param_grid=self.param_grid)
+        clf = grid_fit(grid, x_train, y_train, sample_weight)
         C, gamma = clf.best_params_['classify__C'], clf.best_params_['classify__gamma'],
         self.best_score = clf.best_score_
         return clf.best_estimator_
@@ -137,24 +201,68 @@ class SvmClassifier:
             self.param_grid = [{'classify__kernel': [kernel], 'classify__C': C_range, 'classify__gamma': gamma_range}]
 
 
+class ApproxSvmClassifier:
+    """ rbf kernel approximated by explicit features (Nystroem or random
+    Fourier features) and a linear solver, scales linearly in sample count
+    """
+
+    def __init__(self, kernel='nystroem', solver='linear', n_components=500, cv=5,
+                 grid_search=True, probability=False, n_jobs=-1):
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.is_grid_search = grid_search
+        self.probability = probability
+        if kernel == 'nystroem':
+            feature = Nystroem(kernel='rbf', n_components=n_components, random_state=1)
+        else:
+            feature = RBFSampler(n_components=n_components, random_state=1)
+        if solver == 'sgd':
+            classify = SGDClassifier(class_weight='balanced', random_state=1)
+            self.param_grid = {'classify__alpha': np.logspace(-7, -1, 7)}
+        else:
+            classify = LinearSVC(class_weight='balanced')
+            self.param_grid = {'classify__C': np.logspace(-5, 15, 11, base=2)}
+        self.param_grid['feature__gamma'] = np.logspace(-15, 3, 10, base=2)
+        self.clf = Pipeline([
+            ('feature', feature),
+            ('classify', classify)
+        ])
+
+    def train(self, x_train, y_train, sample_weight=None):
+        if self.is_grid_search:
+            clf = self.grid_search(x_train, y_train, sample_weight)
+        else:
+            clf = fit(self.clf, x_train, y_train, sample_weight)
+        if self.probability:
+            clf = calibrate(clf, x_train, y_train, sample_weight)
+        return clf
+
+    def grid_search(self, x_train, y_train, sample_weight=None):
+        grid = GridSearchCV(self.clf, cv=5, n_jobs=self.n_jobs, param_grid=self.param_grid)
+        clf = grid_fit(grid, x_train, y_train, sample_weight)
+        self.best_score = clf.best_score_
+        return clf.best_estimator_
+
+
 class KnnClassifier:
 
-    def __init__(self, cv=5, n_neighbors=6, ):
+    def __init__(self, cv=5, n_neighbors=6, n_jobs=-1):
         self.n_neighbors = n_neighbors
         self.cv = cv
+        self.clf = KNeighborsClassifier(self.n_neighbors, weights='distance', n_jobs=n_jobs)
 
     def train(self, x_train, y_train):
-        clf = KNeighborsClassifier(self.n_neighbors, weights='distance', n_jobs=-1)
-        clf = clf.fit(x_train, y_train)
+        clf = self.clf.fit(x_train, y_train)
         return clf
 
 class RfClassifier:
 
-    def __init__(self, cv=5, n_estimators=30):
-        self.n_neighbors = n_estimators
+    def __init__(self, cv=5, n_estimators=30, n_jobs=-1):
+        self.n_estimators = n_estimators
         self.cv = cv
+        self.clf = RandomForestClassifier(n_estimators=n_estimators, class_weight='balanced',
+                                          n_jobs=n_jobs, random_state=1)
 
     def train(self, x_train, y_train):
-        clf = RandomForestClassifier(n_estimators=30, class_weight='balanced', n_jobs=-1)
-        clf = clf.fit(x_train, y_train)
+        clf = self.clf.fit(x_train, y_train)
         return clf
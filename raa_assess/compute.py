@@ -1,88 +1,449 @@
 import os
 import json
+import time
 from functools import partial
 from concurrent import futures
+from multiprocessing import shared_memory
 
 import numpy as np
+from sklearn.svm import LinearSVC
+from sklearn.base import clone
+from sklearn.metrics import multilabel_confusion_matrix, roc_curve, roc_auc_score
 from sklearn.feature_selection import SelectKBest, VarianceThreshold
+from sklearn.preprocessing import label_binarize
+from sklearn.model_selection import StratifiedKFold, cross_val_predict, train_test_split
 
 from . import classify as al
 from . import utils as ul
 
 
-def model_hpo(x, y):
-    model = al.SvmClassifier()
-    clf = model.train(x, y)
+MODEL = {'svm': al.SvmClassifier, 'asvm': al.ApproxSvmClassifier}
+
+
+def model_hpo(x, y, model='svm', sample_weight=None, n_jobs=-1, probability=False):
+    model = MODEL[model](n_jobs=n_jobs, probability=probability)
+    clf = model.train(x, y, sample_weight=sample_weight)
     return clf
     
-def evaluate(clf, x, y, cv=-1, **kwargs):
-    evalor = al.Evaluate(clf, x, y)
-    k = int(cv)
-    if k == -1:
-        metrics = evalor.loo() ## to do
-    elif int(k):
-        metrics = evalor.kfold(k)
+def evaluate(clf, x, y, cv=-1, weight=None, repeat=1, n_jobs=1, **kwargs):
+    """ -1 or None is leave-one-out, a fraction in (0, 1) is the test size of
+    holdout, an integer >= 2 is stratified k-fold, repeated if repeat > 1
+    """
+    evalor = al.Evaluate(clf, x, y, weight=weight, n_jobs=n_jobs)
+    if cv is None or cv == -1:
+        metrics = evalor.loo()
+    elif 0 < cv < 1:
+        metrics = evalor.holdout(cv)
+    elif cv >= 2:
+        metrics = evalor.kfold(int(cv), repeat=repeat)
     else:
-        metrics = evalor.holdout(k)
+        raise ValueError(f'cv should be -1, a fraction in (0, 1) or a fold >= 2, not {cv}')
     return metrics
 
-def process_eval_func(file, cv=-1, hpo=1): # 
-    hpo_x, hpo_y = ul.data_to_hpo(file, hpo=1)
-    clf = model_hpo(hpo_x, hpo_y)
+def cv_mode(cv, repeat=1):
+    """ name of the validation mode, recorded with the results """
+    if cv is None or cv == -1:
+        return 'loo'
+    if 0 < cv < 1:
+        return f'holdout{cv:g}'
+    return f'{int(cv)}fold' + (f'x{repeat}' if repeat > 1 else '')
+
+def process_eval_func(file, cv=-1, hpo=1, model='svm', dedup=False, repeat=1, n_jobs=1): # 
+    """ hyper-parameter search on a `hpo` fraction of the samples, then
+    validate the tuned model with `cv`, folds run in n_jobs threads """
     eval_x, eval_y = ul.load_normal_data(file)
-    metrics = evaluate(clf, eval_x, eval_y, cv=-1)
+    weight = None
+    if dedup:
+        # duplicated samples become one weighted sample, so they are fitted
+        # once and always fall into the same fold
+        eval_x, eval_y, weight, conflict = ul.dedup_data(eval_x, eval_y)
+        if conflict:
+            print(f'{conflict} feature vectors have conflicting labels')
+    hpo_x, hpo_y, hpo_w = ul.data_to_hpo((eval_x, eval_y), hpo=hpo, weight=weight)
+    clf = model_hpo(hpo_x, hpo_y, model=model, sample_weight=hpo_w, n_jobs=n_jobs)
+    metrics = evaluate(clf, eval_x, eval_y, cv=cv, weight=weight, repeat=repeat, n_jobs=n_jobs)
     return metrics
 
-def all_eval(folder_n, result_path, n, cv, hpo, cpu):
+def all_eval(folder_n, result_path, n, cv, hpo, cpu, model='svm', dedup=False, repeat=1):
+    tasks = []
+    for type_dir, file_ls in ul.parse_path(folder_n, filter_format='csv'):
+        type_num = os.path.basename(type_dir)
+        for file in file_ls:
+            tasks.append((os.path.join(type_dir, file), [type_num, f"{file.split('_')[0]}"]))
+    naa_path = os.path.join(folder_n, f'20_{n}n.csv')
+    if os.path.exists(naa_path):
+        tasks.append((naa_path, ['natural amino acids', '20s']))
+    # schemes share the cpu budget first, the cpus left go to folds
+    max_work = max(1, int(min(cpu, os.cpu_count())))
+    outer = max(1, min(max_work, len(tasks)))
+    n_jobs = max(1, max_work // outer)
+    mode = {'cv': cv_mode(cv, repeat), 'hpo': 1 if hpo is None else hpo}
     to_do_map = {}
     result_dic = {}
-    max_work = min(cpu, os.cpu_count())
-    with futures.ProcessPoolExecutor(int(max_work)) as pp:
-        evla_func = partial(process_eval_func, cv=cv, hpo=hpo)
-        for type_dir, file_ls in ul.parse_path(folder_n, filter_format='csv'):
-            for file in file_ls:
-                file_path = os.path.join(type_dir, file)
-                future = pp.submit(evla_func, file_path)
-                type_num = os.path.basename(type_dir)
-                to_do_map[future] = [type_num, f"{file.split('_')[0]}"]
-        else:
-            naa_path = os.path.join(folder_n, f'20_{n}n.csv')
-            if os.path.exists(naa_path):
-                future = pp.submit(evla_func, naa_path)
-                to_do_map[future] = ['natural amino acids', '20s']
+    with futures.ProcessPoolExecutor(outer) as pp:
+        evla_func = partial(timed, process_eval_func, cv=cv, hpo=hpo, model=model,
+                            dedup=dedup, repeat=repeat, n_jobs=n_jobs)
+        for file_path, info in tasks:
+            future = pp.submit(evla_func, file_path)
+            to_do_map[future] = info
         done_iter = futures.as_completed(to_do_map)
+        naa_dic = None
         for it in done_iter:
             info = to_do_map[it]
-            metric = it.result()
-            acc, sn, sp, ppv, mcc = metric[0]
-            one_dic = {'sn': sn.tolist(), 'sp': sp.tolist(), 'ppv': ppv.tolist(),
-                      'acc': acc.tolist(), 'mcc': mcc.tolist()}
+            metric, _, elapsed = it.result()
+            one_dic = metric_dic(metric, elapsed, **mode)
             if info[-1] == '20s':
                 naa_dic = one_dic
             else:
                 Type, size = info
                 result_dic.setdefault(Type, {})
                 result_dic[Type][size] = one_dic
-        for t in result_dic:
-            print(t)
+    write_result(result_dic, naa_dic, result_path)
+
+def proxy_eval_func(file, sample=0.3, fold=3):
+    """ cheap score of a feature file, a linear svm with few folds on a subsample
+    :param file: feature file or (x, y)
+    :param sample: fraction of samples to use, float
+    :param fold: number of stratified folds, int
+    :return: metrics, confusion matrix
+    """
+    x, y = ul.load_normal_data(file)
+    if sample < 1:
+        x, _, y, _ = train_test_split(x, y, train_size=sample, shuffle=True,
+                                      random_state=1, stratify=y)
+    fold = max(2, min(fold, np.unique(y, return_counts=True)[1].min()))
+    skf = StratifiedKFold(n_splits=fold, shuffle=True, random_state=1)
+    clf = LinearSVC(class_weight='balanced')
+    y_pre = cross_val_predict(clf, x, y, cv=skf)
+    metric = al.Evaluate(clf, x, y).metrics_(y, y_pre)
+    cm = multilabel_confusion_matrix(y, y_pre)
+    return metric, cm
+
+def adaptive_eval(folder_n, result_path, n, cv, hpo, cpu, rounds=2, keep=0.3, sample=0.3,
+                  model='svm', dedup=False, repeat=1):
+    """ successive halving over schemes, every scheme is scored with the proxy,
+    only the best `keep` fraction is promoted to the next round with a larger
+    subsample, and the survivors of the last round get process_eval_func
+    :param rounds: number of proxy rounds, int
+    :param keep: fraction of schemes promoted after each round, float
+    :param sample: subsample fraction of the first round, grows by 1/keep, float
+    :return:
+    """
+    candidates = {}
+    for type_dir, file_ls in ul.parse_path(folder_n, filter_format='csv'):
+        type_num = os.path.basename(type_dir)
+        for file in file_ls:
+            candidates[(type_num, file.split('_')[0])] = os.path.join(type_dir, file)
+    result_dic = {}
+    max_work = min(cpu, os.cpu_count())
+    with futures.ProcessPoolExecutor(max(1, int(max_work))) as pp:
+        for r in range(rounds):
+            frac = min(1, sample / keep ** r)
+            evla_func = partial(timed, proxy_eval_func, sample=frac)
+            to_do_map = {pp.submit(evla_func, path): info for info, path in candidates.items()}
+            scores = []
+            for it in futures.as_completed(to_do_map):
+                Type, size = to_do_map[it]
+                metric, _, elapsed = it.result()
+                one_dic = metric_dic(metric, elapsed, cv='proxy3fold', hpo=None, sample=frac)
+                one_dic['fidelity'] = f'proxy{r}'
+                result_dic.setdefault(Type, {})[size] = one_dic
+                scores.append((np.mean(one_dic['acc']), (Type, size)))
+            scores.sort(key=lambda x: x[0], reverse=True)
+            promote = max(1, int(np.ceil(len(scores) * keep)))
+            candidates = {info: candidates[info] for _, info in scores[:promote]}
+            print(f'{n}n --> round {r}: {promote}/{len(scores)} schemes promoted')
+        evla_func = partial(timed, process_eval_func, cv=cv, hpo=hpo, model=model,
+                            dedup=dedup, repeat=repeat)
+        to_do_map = {pp.submit(evla_func, path): info for info, path in candidates.items()}
+        naa_path = os.path.join(folder_n, f'20_{n}n.csv')
+        if os.path.exists(naa_path):
+            to_do_map[pp.submit(evla_func, naa_path)] = ['natural amino acids', '20s']
+        naa_dic = None
+        for it in futures.as_completed(to_do_map):
+            info = to_do_map[it]
+            metric, _, elapsed = it.result()
+            one_dic = metric_dic(metric, elapsed, cv=cv_mode(cv, repeat),
+                                 hpo=1 if hpo is None else hpo)
+            one_dic['fidelity'] = 'full'
+            if info[-1] == '20s':
+                naa_dic = one_dic
+            else:
+                Type, size = info
+                result_dic[Type][size] = one_dic
+    write_result(result_dic, naa_dic, result_path)
+
+def pipeline_eval(file_list, folder_n, result_path, n, cluster_info, cv, hpo, cpu,
+                  model='svm', dedup=False, repeat=1):
+    """ reduce and evaluate in one process pool, a scheme is evaluated as soon
+    as its feature file is written, so evaluation does not wait for the whole
+    reduce stage and both stages share the same workers
+    :param file_list: fasta files, list
+    :param folder_n: feature folder, string
+    :param result_path: result json path, string
+    :param n: k-mer, int
+    :param cluster_info: rows of reduce_query, list
+    :param cpu: number of processes shared by reduce and eval, int
+    :return:
+    """
+    ul.mkdirs(folder_n)
+    todo, seen = [], set()
+    for tpi, size, cluster, _ in cluster_info:
+        info = [f"type{tpi}", f"{size}"]
+        if (tpi, size) in seen:
+            continue
+        seen.add((tpi, size))
+        aa = [i for i in cluster.split('-') if i]
+        file_path = os.path.join(folder_n, f"type{tpi}", f"{size}_{n}n.csv")
+        todo.append((info, file_path, aa))
+    naa_path = os.path.join(folder_n, f'20_{n}n.csv')
+    todo.append((['natural amino acids', '20s'], naa_path, ul.NAA))
+    todo.reverse()
+    max_work = max(1, int(min(cpu, os.cpu_count())))
+    reducing, evaluating = {}, {}
+    result_dic, naa_dic = {}, None
+    evla_func = partial(timed, process_eval_func, cv=cv, hpo=hpo, model=model,
+                        dedup=dedup, repeat=repeat)
+    mode = {'cv': cv_mode(cv, repeat), 'hpo': 1 if hpo is None else hpo}
+    with futures.ProcessPoolExecutor(max_work) as pp:
+        while todo or reducing or evaluating:
+            # keep every worker busy but never queue a reduce task behind an
+            # eval task, so finished feature files wait at most one round
+            while todo and len(reducing) + len(evaluating) < max_work:
+                info, file_path, aa = todo.pop()
+                ul.mkdirs(os.path.dirname(file_path))
+                future = pp.submit(ul.one_file, file_list, file_path, aa, n, idx=info[-1],
+                                   dedup=dedup)
+                reducing[future] = info, file_path
+            done, _ = futures.wait(list(reducing) + list(evaluating),
+                                   return_when=futures.FIRST_COMPLETED)
+            for it in done:
+                if it in reducing:
+                    info, file_path = reducing.pop(it)
+                    it.result()
+                    evaluating[pp.submit(evla_func, file_path)] = info
+                    print(f'{n}n --> {info}', 'has reduced!')
+                    continue
+                info = evaluating.pop(it)
+                metric, _, elapsed = it.result()
+                one_dic = metric_dic(metric, elapsed, **mode)
+                if info[-1] == '20s':
+                    naa_dic = one_dic
+                else:
+                    Type, size = info
+                    result_dic.setdefault(Type, {})
+                    result_dic[Type][size] = one_dic
+                print(f'{n}n --> {info}', 'has evaluated!')
+    write_result(result_dic, naa_dic, result_path)
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    metric, cm = func(*args, **kwargs)
+    return metric, cm, time.time() - start
+
+def metric_dic(metric, elapsed=None, **info):
+    acc, sn, sp, ppv, mcc = metric
+    one_dic = {'sn': sn.tolist(), 'sp': sp.tolist(), 'ppv': ppv.tolist(),
+               'acc': acc.tolist(), 'mcc': mcc.tolist()}
+    if elapsed is not None:
+        one_dic['time'] = elapsed
+    one_dic.update(info)
+    return one_dic
+
+def write_result(result_dic, naa_dic, result_path):
+    """ add the natural amino acids result to every type and dump json
+    :param result_dic: {typeN: {size: metric_dic}}, dict
+    :param naa_dic: metric dict of 20 natural amino acids, dict or None
+    :param result_path: json file path, string
+    :return:
+    """
+    for t in result_dic:
+        print(t)
+        if naa_dic is not None:
             result_dic[t]['20'] = naa_dic
     with open(result_path, 'w', encoding='utf-8') as f:
         json.dump(result_dic, f)
 
-def al_comparison(file_path,):
-    """
+def al_comparison(file_path, cv=5, cpu=1, model='svm'):
+    """ compare SVM, RF and KNN on the same stratified folds, the feature
+    matrix is put into shared memory once and every classifier x fold runs
+    in one process pool of `cpu` single-threaded workers. the svm is tuned
+    by model_hpo on the training part of each fold only. the roc of two
+    classes treats the larger label as positive, with more classes it is the
+    micro-average of the one-vs-rest curves of every class
     :param file_path: feature file path
-    :return:
+    :param cv: number of folds, int
+    :return: {classifier: (fpr, tpr, acc, sn, sp, ppv, mcc, auc)}
     """
-    classifier = {'SVM': al.SvmClassifier, 'RF': al.RfClassifier, 'KNN': al.KnnClassifier}
+    x, y = ul.load_normal_data(file_path)
+    max_work = max(1, int(min(cpu, os.cpu_count())))
+    classifier = {'SVM': model,
+                  'RF': al.RfClassifier(n_jobs=1).clf,
+                  'KNN': al.KnnClassifier(n_jobs=1).clf}
+    skf = StratifiedKFold(n_splits=int(cv), shuffle=True, random_state=1)
+    splits = list(skf.split(x, y))
+    shm = shared_memory.SharedMemory(create=True, size=x.nbytes)
+    try:
+        np.ndarray(x.shape, dtype=x.dtype, buffer=shm.buf)[:] = x
+        init_args = (shm.name, x.shape, x.dtype, y)
+        with futures.ProcessPoolExecutor(max_work, initializer=_attach_data,
+                                         initargs=init_args) as pp:
+            to_do_map = {}
+            for name, clf in classifier.items():
+                for train_idx, test_idx in splits:
+                    future = pp.submit(fold_func, clf, train_idx, test_idx)
+                    to_do_map[future] = name, test_idx
+            classes = np.unique(y)
+            y_pre = {name: np.zeros(len(y)) for name in classifier}
+            y_score = {name: np.zeros((len(y), len(classes))) for name in classifier}
+            for it in futures.as_completed(to_do_map):
+                name, test_idx = to_do_map[it]
+                y_pre[name][test_idx], y_score[name][test_idx] = it.result()
+    finally:
+        shm.close()
+        shm.unlink()
     result_dic = {}
-    for clf in classifier:
-        model = drill(classifier[clf], file_path)
-        metrics, auc = evaluate(model, file_path)
-        result_dic[clf] = (*metrics[5:], auc) # sn, sp, presision, acc, mcc, fpr, tpr, auc
+    # one column, of the larger label, for two classes
+    y_true = label_binarize(y, classes=classes)
+    for name in classifier:
+        metric = al.Evaluate(None, x, y).metrics_(y, y_pre[name])
+        score = y_score[name][:, -y_true.shape[1]:]
+        fpr, tpr, _ = roc_curve(y_true.ravel(), score.ravel())
+        auc = roc_auc_score(y_true, score, average='micro')
+        result_dic[name] = (fpr, tpr, *metric, auc)
     return result_dic
 
-def feature_select(feature_file, cv=-1, hpo=1):
+_DATA = {}
+
+def _attach_data(name, shape, dtype, y):
+    shm = shared_memory.SharedMemory(name=name)
+    _DATA['shm'] = shm
+    _DATA['x'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _DATA['y'] = y
+
+def fold_func(clf, train_idx, test_idx):
+    """ fit one classifier on one fold of the shared data, a model name of
+    MODEL is first tuned by model_hpo on the training indices
+    :return: prediction, score of every class in the order of np.unique(y),
+             decision function of the svm or class probability of rf and knn
+    """
+    x, y = _DATA['x'], _DATA['y']
+    if isinstance(clf, str):
+        clf = model_hpo(x[train_idx], y[train_idx], model=clf, n_jobs=1)
+    clf = clone(clf).fit(x[train_idx], y[train_idx])
+    x_test = x[test_idx]
+    if hasattr(clf, 'decision_function'):
+        score = clf.decision_function(x_test)
+        if score.ndim == 1:
+            score = np.column_stack([-score, score])
+    else:
+        score = clf.predict_proba(x_test)
+    classes = np.unique(y)
+    class_score = np.zeros((len(test_idx), len(classes)))
+    class_score[:, np.searchsorted(classes, clf.classes_)] = score
+    return clf.predict(x_test), class_score
+
+def naa_kmer(file_list, n):
+    """ overlapping k-mer frequency of the 20 natural amino acids, columns in
+    the order of product(NAA, repeat=n), residues out of NAA break k-mers
+    :return: x, y
+    """
+    x, y = [], []
+    for idx, file in enumerate(file_list):
+        _, residues, offsets = ul.load_fasta(file)
+        x.extend(ul.kmer_freq(residues, offsets, ul.NAA, n, overlap=True))
+        y.extend([idx] * (len(offsets) - 1))
+    return np.array(x), np.array(y)
+
+def merge_columns(x, mapping, n):
+    """ k-mer frequency of a partition from the frequency of its parent, the
+    columns of parent k-mers falling into the same child k-mer are summed
+    :param x: parent k-mer frequency, columns in product order, array
+    :param mapping: child cluster index of every parent cluster, array
+    :return: child k-mer frequency
+    """
+    s_old, s_new = len(mapping), mapping.max() + 1
+    digits = np.indices([s_old] * n).reshape(n, -1)
+    new_col = (mapping[digits] * (s_new ** np.arange(n - 1, -1, -1))[:, None]).sum(axis=0)
+    order = np.argsort(new_col, kind='stable')
+    starts = np.flatnonzero(np.diff(new_col[order], prepend=-1))
+    return np.add.reduceat(x[:, order], starts, axis=1)
+
+def merge_eval_func(x, y, part, pairs, n, cv=-1, hpo=1, model='svm', proxy=False, repeat=1):
+    result = []
+    for i, j in pairs:
+        mapping = merge_mapping(len(part), i, j)
+        data = merge_columns(x, mapping, n), y
+        if proxy:
+            metric, _ = proxy_eval_func(data, sample=1)
+        else:
+            metric, _ = process_eval_func(data, cv=cv, hpo=hpo, model=model, repeat=repeat)
+        result.append(((i, j), np.mean(metric[0])))
+    return result
+
+def merge_mapping(size, i, j):
+    """ cluster j is merged into cluster i, clusters after j shift down """
+    mapping = np.arange(size)
+    mapping[j] = i
+    mapping[j+1:] -= 1
+    return mapping
+
+def merge_search(file_list, n, cv, hpo, cpu, beam=1, min_size=2, model='svm', proxy=False,
+                 repeat=1):
+    """ search reduced alphabets by merging clusters, starting from the 20
+    natural amino acids every pair of clusters of the partitions in the beam
+    is merged and scored, the best `beam` partitions go on to the next size.
+    k-mer counts of a candidate come from summing columns of its parent, so
+    sequences are read only once. k-mers are counted overlapping.
+    :param beam: number of partitions kept at each size, 1 is greedy, int
+    :param min_size: smallest size to search, int
+    :param proxy: score candidates with proxy_eval_func, bool
+    :return: best partition of each size, rows like reduce_query
+    """
+    x, y = naa_kmer(file_list, n)
+    beam_ls = [(list(ul.NAA), x)]
+    rows = []
+    max_work = max(1, int(min(cpu, os.cpu_count())))
+    evla_func = partial(merge_eval_func, n=n, cv=cv, hpo=hpo, model=model, proxy=proxy,
+                        repeat=repeat)
+    with futures.ProcessPoolExecutor(max_work) as pp:
+        for size in range(len(ul.NAA) - 1, min_size - 1, -1):
+            to_do_map = {}
+            seen = set()
+            for b, (part, px) in enumerate(beam_ls):
+                pairs = []
+                for i in range(len(part)):
+                    for j in range(i + 1, len(part)):
+                        # the same partition reached by other merge orders gets the same key
+                        child = [c for c in part if c not in (part[i], part[j])]
+                        child.append(part[i] + part[j])
+                        key = frozenset(''.join(sorted(c)) for c in child)
+                        if key not in seen:
+                            seen.add(key)
+                            pairs.append((i, j))
+                chunk = int(np.ceil(len(pairs) / max_work))
+                for c in range(0, len(pairs), chunk):
+                    future = pp.submit(evla_func, px, y, part, pairs[c:c+chunk])
+                    to_do_map[future] = b
+            scores = []
+            for it in futures.as_completed(to_do_map):
+                b = to_do_map[it]
+                scores.extend((acc, b, pair) for pair, acc in it.result())
+            scores.sort(key=lambda x: x[0], reverse=True)
+            next_beam = []
+            for acc, b, (i, j) in scores[:beam]:
+                part, px = beam_ls[b]
+                child = part.copy()
+                child[i] = ''.join(sorted(part[i] + part[j]))
+                del child[j]
+                next_beam.append((child, merge_columns(px, merge_mapping(len(part), i, j), n)))
+            beam_ls = next_beam
+            best_acc, best_part = scores[0][0], beam_ls[0][0]
+            rows.append(('search', size, '-'.join(best_part), f'merge {n}n acc={best_acc:.4f}'))
+            print(f'{n}n --> size {size}', '-'.join(best_part), f'{best_acc:.4f}')
+    return rows
+
+def feature_select(feature_file, cv=-1, hpo=1, model='svm', dedup=False, repeat=1):
     X, y = ul.load_normal_data(feature_file)
     selector = VarianceThreshold()
     new_x = selector.fit_transform(X)
@@ -95,7 +456,8 @@ def feature_select(feature_file, cv=-1, hpo=1):
     feature_idx = [i[0] for i in rank_score]
     with futures.ProcessPoolExecutor() as pp:
         to_do_map = {}
-        evla_func = partial(process_eval_func, cv=cv, hpo=hpo)
+        evla_func = partial(process_eval_func, cv=cv, hpo=hpo, model=model,
+                            dedup=dedup, repeat=repeat)
         for i, idx in enumerate(feature_idx):
             index = feature_idx[:i+1]
             x = X[:, index]
@@ -111,15 +473,18 @@ def feature_select(feature_file, cv=-1, hpo=1):
         acc_ls.sort()
     return acc_ls
 
-def feature_mix(files, cv=-1, hpo=1):
+def feature_mix(files, cv=-1, hpo=1, model='svm', dedup=False, repeat=1):
     data_ls = [np.genfromtxt(file, delimiter=',')[1:] for file in files]
     mix_data = np.hstack(data_ls)
     x = mix_data[:, 1:]
     y = mix_data[:, 0]
-    acc_ls = feature_select((x, y), cv=-1, hpo=1)
+    acc_ls = feature_select((x, y), cv=cv, hpo=hpo, model=model, dedup=dedup, repeat=repeat)
     return acc_ls
 
-def own_func(file_ls, feature_file, cluster, n):
-    ul.one_file(file_ls, feature_file, cluster, n, idx=len(cluster))
-    metrics, cm = process_eval_func(feature_file, cv=-1, hpo=1)
+def own_func(file_ls, feature_file, cluster, n, cv=-1, hpo=1, model='svm', dedup=False,
+             repeat=1, cpu=1):
+    ul.one_file(file_ls, feature_file, cluster, n, idx=len(cluster), dedup=dedup)
+    n_jobs = max(1, int(min(cpu, os.cpu_count())))
+    metrics, cm = process_eval_func(feature_file, cv=cv, hpo=hpo, model=model, dedup=dedup,
+                                    repeat=repeat, n_jobs=n_jobs)
     return metrics, cm
@@ -116,6 +116,7 @@ def p_roc_al(param, out):
     plt.xlabel('False positive rate')
     plt.ylabel('True positive rate')
     plt.title('ROC curve')
+    plt.legend(loc='best')
     plt.savefig(out, dpi=600)
 
 def p_fs(score_ls, out):
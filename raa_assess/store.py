@@ -0,0 +1,146 @@
+"""
+    :Description:
+        sqlite store of evaluate results, one row per (run, k, type, size,
+        classifier, class), so that results of many sweeps can be compared
+        and queried without walking nested result json files.
+"""
+import os
+import time
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+METRICS = ['acc', 'sn', 'sp', 'ppv', 'mcc']
+NAA_TYPE = 0
+
+
+def connect(db):
+    """ open the store for writing, it is created if missing """
+    conn = sqlite3.connect(db, timeout=60)
+    conn.execute('create table if not exists result( \
+                run text not null, k int not null, \
+                type int not null, size int not null, \
+                classifier text not null, cv text not null, hpo real, \
+                fidelity text, cls int not null, \
+                acc real, sn real, sp real, ppv real, mcc real, time real)')
+    conn.execute('create index if not exists result_run on result(k, run, classifier)')
+    conn.execute('create index if not exists result_acc on result(cls, acc desc)')
+    return conn
+
+def open_store(db):
+    """ open the store read-only for queries, a missing store is an error
+    instead of being created empty """
+    if not os.path.isfile(db):
+        raise ValueError(f'no result store {db}')
+    return sqlite3.connect(f'{Path(os.path.abspath(db)).as_uri()}?mode=ro', uri=True, timeout=60)
+
+def new_run():
+    """ default run name, created once per command so that all k share it """
+    return time.strftime('%Y%m%d-%H%M%S')
+
+def result_rows(result_dic, k, run, classifier='svm', cv=-1, hpo=1):
+    """ flatten {typeN: {size: metric_dic}} into store rows, the natural
+    amino acids result is repeated under every type of the json and is
+    stored only once with type 0. cv and hpo recorded in a metric_dic, like
+    those of proxy scores, win over the values of the command
+    """
+    rows = []
+    naa_dic = None
+    for type_id, type_ in result_dic.items():
+        for size, one_dic in type_.items():
+            if size == '20':
+                naa_dic = one_dic
+                continue
+            rows.extend(_metric_rows(one_dic, int(type_id[4:]), int(size), cv, hpo))
+    if naa_dic is not None:
+        rows.extend(_metric_rows(naa_dic, NAA_TYPE, 20, cv, hpo))
+    info = (run, k, classifier)
+    return [info + row for row in rows]
+
+def _metric_rows(one_dic, type_id, size, cv, hpo):
+    cv, hpo = str(one_dic.get('cv', cv)), one_dic.get('hpo', hpo)
+    fidelity = one_dic.get('fidelity', 'full')
+    elapsed = one_dic.get('time')
+    values = zip(*[one_dic[key] for key in METRICS])
+    return [(cv, hpo, type_id, size, fidelity, cls, *value, elapsed)
+            for cls, value in enumerate(values)]
+
+def save(db, result_dic, k, run=None, classifier='svm', cv=-1, hpo=1):
+    """ add a result dict of one k to the store
+    :param db: store path, string
+    :param result_dic: {typeN: {size: metric_dic}}, dict
+    :param run: run name, default is the current time, string
+    :return: run name
+    """
+    run = run if run else new_run()
+    rows = result_rows(result_dic, k, run, classifier=classifier, cv=cv, hpo=hpo)
+    conn = connect(db)
+    with conn:
+        conn.execute('delete from result where run=? and k=? and classifier=?',
+                     (run, k, classifier))
+        conn.executemany('insert into result(run, k, classifier, cv, hpo, type, size, \
+                          fidelity, cls, acc, sn, sp, ppv, mcc, time) \
+                          values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.close()
+    return run
+
+def load_scores(db, k, run=None, classifier='svm', key='acc', filter_num=0, cls=0):
+    """ vectorized replacement of utils.dic2array on the store, proxy scores
+    are nan but count toward filter_num like in dic2array
+    :param run: run name, default is the run of k saved last, string
+    :return: (all_score_array, type_ls), (filtered_score_array, filtered_type_ls)
+    """
+    if key not in METRICS:
+        raise ValueError(f'unknown metric {key}')
+    conn = open_store(db)
+    if run is None:
+        # by insertion order, custom run names do not sort like timestamps
+        row = conn.execute('select run from result where k=? and classifier=? \
+                            order by rowid desc limit 1', (k, classifier)).fetchone()
+        run = row[0] if row else None
+    rows = conn.execute(f'select type, size, \
+                          case when fidelity=\'full\' then {key} end \
+                          from result \
+                          where run=? and k=? and classifier=? and cls=?',
+                        (run, k, classifier, cls)).fetchall()
+    conn.close()
+    if not rows:
+        raise ValueError(f'no results of k={k}, classifier={classifier}, '
+                         f'run={run if run else "any"} in {db}')
+    data = np.array(rows, dtype=float).reshape(-1, 3)
+    types, sizes, scores = data[:, 0].astype(int), data[:, 1].astype(int), data[:, 2]
+    is_naa = types == NAA_TYPE
+    type_arr, type_idx = np.unique(types[~is_naa], return_inverse=True)
+    all_score_array = np.zeros([len(type_arr), 19])
+    all_score_array[type_idx, sizes[~is_naa] - 2] = scores[~is_naa]
+    counts = np.bincount(type_idx, minlength=len(type_arr))
+    if is_naa.any():
+        all_score_array[:, 18] = scores[is_naa][0]
+        counts = counts + 1
+    type_ls = [f'type{i}' for i in type_arr]
+    keep = counts >= filter_num
+    filtered_type_ls = [t for t, m in zip(type_ls, keep) if m]
+    all_score = (all_score_array, type_ls)
+    filtered_score = (all_score_array[keep], filtered_type_ls)
+    return all_score, filtered_score
+
+def top(db, n=10, key='acc', k=None, run=None, cls=0):
+    """ best n (run, k, type, size, classifier) full results ordered by a metric """
+    if key not in METRICS:
+        raise ValueError(f'unknown metric {key}')
+    sql = f'select run, k, type, size, classifier, cv, {key} from result \
+            where cls=? and fidelity=\'full\''
+    param = [cls]
+    if k is not None:
+        sql += ' and k=?'
+        param.append(k)
+    if run is not None:
+        sql += ' and run=?'
+        param.append(run)
+    sql += f' order by {key} desc limit ?'
+    param.append(n)
+    conn = open_store(db)
+    rows = conn.execute(sql, param).fetchall()
+    conn.close()
+    return rows
@@ -1,6 +1,9 @@
 import os
 import csv
 import re
+import mmap
+import json
+import hashlib
 import sqlite3
 from itertools import product
 from concurrent import futures
@@ -13,6 +16,8 @@ from . import draw
 
 BASE_PATH = os.path.dirname(__file__)
 RAA_DB = os.path.join(BASE_PATH, 'raa_data.db')
+MANIFEST = 'manifest.json'
+WHITESPACE = b' \t\n\v\f\r'
 NAA = ['A', 'G', 'S', 'T', 'R', 'Q', 'E', 'K', 'N', 'D',
     'C', 'H', 'I', 'L', 'M', 'V', 'F', 'Y', 'P', 'W']
 
@@ -30,20 +35,183 @@ def reduce_query(type_id, size):
     return raa_clusters
 
 def read_fasta(seq):
-    lines = []
+    title, lines = None, []
     for line in seq:
         if not line:
             continue
         if line[0] == '>':
             if lines:
-                yield title, ''.join(lines)
+                yield title or '', ''.join(lines)
                 lines = []
             title = line[1:].strip()
         else:
-            line = line.replace(' ', '').replace('\r', '')
-            lines.append(line.strip())
-    else:
-        yield title, ''.join(lines)
+            line = line.replace(' ', '').replace('\r', '').strip()
+            if line:
+                lines.append(line)
+    if lines:
+        yield title or '', ''.join(lines)
+
+def load_fasta(file, chunk=1 << 20):
+    """ parse a fasta file at byte level, the file is memory-mapped and read
+    in chunks cut before a header. header lines of a chunk are found with
+    vectorized byte searches, whitespace is deleted from the record bodies
+    between them with bytes.translate and the residues are copied into one
+    preallocated uint8 buffer, pages of the map already parsed are released,
+    so memory stays near the size of the residues. residues before the first
+    header form a record with an empty title, records without residues are
+    skipped.
+    :param file: fasta file path, string
+    :param chunk: bytes parsed at once, int
+    :return: titles, list; residues, uint8 array of ascii residues;
+             offsets, record i is residues[offsets[i]:offsets[i+1]]
+    """
+    titles, offsets, total, title = [], [0], 0, ''
+    with open(file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return titles, np.zeros(0, dtype=np.uint8), np.zeros(1, dtype=np.int64)
+        residues = np.empty(size, dtype=np.uint8)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            p = 0
+            while p < size:
+                q = mm.rfind(b'\n>', p, p + chunk) + 1
+                if q <= p or p + chunk >= size:
+                    q = min(size, p + chunk)
+                    if mm[p:p+1] == b'>':
+                        # a header is never split between chunks
+                        q = max(q, mm.find(b'\n', p) + 1 or size)
+                data = np.frombuffer(mm, dtype=np.uint8, count=q-p, offset=p)
+                newline = np.flatnonzero(data == 10)
+                starts = np.flatnonzero(data[1:] == 62) + 1
+                starts = starts[data[starts - 1] == 10]
+                if data[0] == 62 and (p == 0 or mm[p-1] == 10):
+                    starts = np.r_[0, starts]
+                ends = np.append(newline, len(data))[np.searchsorted(newline, starts)]
+                del data, newline
+                heads, tails = (starts + p).tolist(), (ends + p).tolist()
+                bodies = [mm[i:j] for i, j in zip([p] + tails, heads + [q])]
+                names = [mm[i+1:j].decode().strip() for i, j in zip(heads, tails)]
+                # whitespace is deleted from the bodies of a chunk in one pass,
+                # the bodies are joined by '>' which marks where headers were
+                joined = b'>'.join(bodies).translate(None, WHITESPACE)
+                if joined.count(b'>') == len(heads):
+                    sep = np.flatnonzero(np.frombuffer(joined, dtype=np.uint8) == 62)
+                    bounds = (total + sep - np.arange(len(sep))).tolist()
+                    body = joined.replace(b'>', b'')
+                else:
+                    # '>' inside a body, whitespace is deleted body by body
+                    bodies = [body.translate(None, WHITESPACE) for body in bodies]
+                    bounds = (total + np.cumsum([len(body) for body in bodies[:-1]],
+                                                dtype=np.int64)).tolist()
+                    body = b''.join(bodies)
+                del bodies, joined
+                residues[total:total+len(body)] = np.frombuffer(body, dtype=np.uint8)
+                total += len(body)
+                for name, bound in zip(names, bounds):
+                    if bound > offsets[-1]:
+                        titles.append(title)
+                        offsets.append(bound)
+                    title = name
+                p = q
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_DONTNEED, 0, p - p % mmap.PAGESIZE)
+    if total > offsets[-1]:
+        titles.append(title)
+        offsets.append(total)
+    return titles, residues[:total], np.array(offsets, dtype=np.int64)
+
+def encode(residues, alphabet):
+    """ map ascii residues to the index of their cluster in alphabet, residues
+    out of alphabet are 255
+    :param residues: uint8 array
+    :param alphabet: clusters, list of strings
+    :return: uint8 array
+    """
+    lut = np.full(256, 255, dtype=np.uint8)
+    for idx, cluster in enumerate(alphabet):
+        lut[np.frombuffer(cluster.encode(), dtype=np.uint8)] = idx
+    return lut[residues]
+
+def kmer_freq(residues, offsets, aa, n, overlap=False, batch=1 << 20):
+    """ reduced k-mer frequency of every record, counted on the residue buffer
+    of load_fasta. residues out of aa break k-mers and the frequency is the
+    count over (record length - n + 1). by default k-mers are counted like
+    str.count in seq_aac, a run of a self-overlapping k-mer (AA, AAA, ABA)
+    is counted without overlap. this only holds for n <= 4, where every
+    period of a k-mer is a multiple of its smallest one.
+    :param aa: cluster aa, columns are in the order of product(raa, repeat=n), list
+    :param overlap: count overlapping k-mers, bool
+    :param batch: records counted in one bincount are bounded by batch
+                  residues and batch k-mer cells, int
+    :return: frequency row of every record, generator of lists
+    """
+    if not overlap and n > 4:
+        raise ValueError(f'non-overlapping counts need n <= 4, not {n}')
+    size = len(aa) ** n
+    weight = len(aa) ** np.arange(n - 1, -1, -1)
+    length = np.diff(offsets)
+    r0 = 0
+    while r0 < len(length):
+        r1 = np.searchsorted(offsets, offsets[r0] + batch, side='right') - 1
+        r1 = max(r0 + 1, min(r1, r0 + batch // size, len(length)))
+        a, b = offsets[r0], offsets[r1]
+        codes = encode(residues[a:b], aa)
+        rec_n = r1 - r0
+        win = max(0, len(codes) - n + 1)
+        kmer = np.zeros(win, dtype=np.int64)
+        valid = np.ones(win, dtype=bool)
+        for c in range(n):
+            kmer += codes[c:c+win] * weight[c]
+            valid &= codes[c:c+win] != 255
+        rec = np.repeat(np.arange(rec_n), length[r0:r1])[:win]
+        valid &= np.arange(win) + n <= (offsets[r0+1:r1+1] - a)[rec]
+        if not overlap and n > 1:
+            valid &= ~_overlapped(kmer, valid, n, len(aa))
+        counts = np.bincount(rec[valid] * size + kmer[valid], minlength=rec_n * size)
+        freq = counts.reshape(rec_n, size) / np.maximum(length[r0:r1] - n + 1, 1)[:, None]
+        yield from freq.tolist()
+        r0 = r1
+
+def _overlapped(kmer, valid, n, s):
+    """ k-mers str.count skips, matches of a k-mer with smallest period q
+    chain every q residues, and only every ceil(n/q)-th match of a chain is
+    counted. k-mers with borders of coprime periods (AABAA, periods 3 and 4)
+    only exist for n > 4 and are not handled
+    """
+    digits = [kmer // s ** (n - 1 - c) % s for c in range(n)]
+    period = np.zeros(len(kmer), dtype=np.int64)
+    for q in range(n - 1, 0, -1):
+        periodic = valid.copy()
+        for c in range(q, n):
+            periodic &= digits[c] == digits[c - q]
+        period[periodic] = q
+    skip = np.zeros(len(kmer), dtype=bool)
+    for q in range(1, n):
+        follow = np.zeros(len(kmer), dtype=bool)
+        follow[q:] = (period[q:] == q) & valid[:-q] & (kmer[q:] == kmer[:-q])
+        chain = np.zeros(len(kmer), dtype=np.int64)
+        for r in range(q):
+            f = follow[r::q]
+            idx = np.arange(len(f))
+            chain[r::q] = idx - np.maximum.accumulate(np.where(f, 0, idx))
+        skip |= (period == q) & (chain % -(-n // q) != 0)
+    return skip
+
+def record_keys(idx, residues, offsets):
+    """ keys of the records of a fasta file, the file index (label) and sha1
+    of the sequence """
+    return [f'{idx}:{hashlib.sha1(residues[i:j]).hexdigest()}'
+            for i, j in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+def select_records(residues, offsets, index):
+    """ residue buffer and offsets of a subset of records """
+    index = np.asarray(index, dtype=np.int64)
+    length = np.diff(offsets)[index]
+    if not len(index):
+        return residues[:0], np.zeros(1, dtype=np.int64)
+    pos = np.repeat(offsets[index] - np.cumsum(np.r_[0, length[:-1]]), length)
+    sub = residues[pos + np.arange(length.sum())]
+    return sub, np.r_[0, np.cumsum(length)].astype(np.int64)
 
 
 def reduce(seqs, aa, raa=None):
@@ -89,7 +257,7 @@ def seq_aac(seqs, raa, n=1):
         aa_fre = [seq.count(i)/seq_len for i in aa]  # (len(seq)-n+1)
         yield title, aa_fre
 
-def one_file(file_list, file_path, aa, n, idx=None,raa=None):
+def one_file(file_list, file_path, aa, n, idx=None,raa=None, dedup=False):
     """ write feature vector to a file
     :param file_list: train file list, list
     :param file_path: one size file path, string
@@ -97,30 +265,112 @@ def one_file(file_list, file_path, aa, n, idx=None,raa=None):
     :param n: k-mer, int
     :param idx: index of reduced scheme in a type,
     :param raa: representative aa, list or tuple
+    :param dedup: count every unique seq once, bool
     :return:
     """
-    
     if os.path.isdir(file_path):
         file_name = f'{idx}_{n}n.csv'
         file_path = os.path.join(file_path, file_name)
     elif os.path.isfile(file_path):
         file_path = file_path
+    check_raa(aa, raa)
     with open(file_path, 'w') as handle:
         h = csv.writer(handle)
         for idx, file in enumerate(file_list):
-            f = open(file, 'r')
-            seq = read_fasta(f)
-            simple_seq = reduce(seq, aa, raa)
-            if not raa:
-                raa = [i[0] for i in aa]
-            base_aac = seq_aac(simple_seq, raa, n)
-            for a in base_aac:
-                line0 = [v for v in a[1]]
-                line1 = [idx] + line0
-                h.writerow(line1)
-            f.close()
-
-def thread_func(file_list, folder_n, n, clusters):
+            _, residues, offsets = load_fasta(file)
+            if not dedup:
+                h.writerows([idx] + row for row in kmer_freq(residues, offsets, aa, n))
+                continue
+            # only the first copy of a record is counted, rows of records
+            # with copies are kept until the copies are written
+            keys = record_keys(idx, residues, offsets)
+            first, copies = {}, set()
+            for i, key in enumerate(keys):
+                if first.setdefault(key, i) != i:
+                    copies.add(key)
+            index = [i for i, key in enumerate(keys) if first[key] == i]
+            rows = kmer_freq(*select_records(residues, offsets, index), aa, n)
+            cache = {}
+            for i, key in enumerate(keys):
+                if first[key] == i:
+                    row = next(rows)
+                    if key in copies:
+                        cache[key] = row
+                else:
+                    row = cache[key]
+                h.writerow([idx] + row)
+
+def check_raa(aa, raa=None):
+    """ every representative aa has to be in its cluster, k-mer columns are in
+    the order of product(raa, repeat=n) """
+    for i, j in zip(aa, raa or []):
+        if j not in i:
+            raise ValueError(f'raa or clustered_aa is wrong!')
+
+def update_file(file_list, file_path, aa, n, keys, old_keys, raa=None):
+    """ splice an existing feature file, rows of kept records are copied and
+    only the new or changed records are reduced and counted
+    :param keys: record keys of current fasta files, list
+    :param old_keys: record keys the feature file was written from, list
+    :return:
+    """
+    with open(file_path, 'r') as handle:
+        rows = list(csv.reader(handle))
+    if len(rows) != len(old_keys):
+        # rewritten by something other than an incremental run
+        return one_file(file_list, file_path, aa, n, raa=raa)
+    row_dic = dict(zip(old_keys, rows))
+    missing = set(keys) - set(row_dic)
+    check_raa(aa, raa)
+    for idx, file in enumerate(file_list):
+        if not missing:
+            break
+        _, residues, offsets = load_fasta(file)
+        file_keys = record_keys(idx, residues, offsets)
+        index = [i for i, key in enumerate(file_keys) if key in missing]
+        missing -= {file_keys[i] for i in index}
+        residues, offsets = select_records(residues, offsets, index)
+        for i, row in zip(index, kmer_freq(residues, offsets, aa, n)):
+            row_dic[file_keys[i]] = [idx] + row
+    with open(file_path, 'w') as handle:
+        h = csv.writer(handle)
+        h.writerows(row_dic[key] for key in keys)
+
+def file_hash(file):
+    sha = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def load_manifest(folder_n):
+    manifest_path = os.path.join(folder_n, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    return {'files': [], 'digest': None, 'schemes': {}, 'records': {}}
+
+def save_manifest(folder_n, manifest):
+    used = {digest for digest, _ in manifest['schemes'].values()}
+    manifest['records'] = {d: k for d, k in manifest['records'].items() if d in used}
+    with open(os.path.join(folder_n, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+
+def record_state(file_list, manifest):
+    """ record keys of the fasta files and their digest, fasta files are only
+    parsed when their content hash differs from the manifest
+    """
+    files = [[os.path.abspath(file), file_hash(file)] for file in file_list]
+    if files == manifest['files'] and manifest['digest'] in manifest['records']:
+        return files, manifest['records'][manifest['digest']], manifest['digest']
+    keys = []
+    for idx, file in enumerate(file_list):
+        _, residues, offsets = load_fasta(file)
+        keys.extend(record_keys(idx, residues, offsets))
+    digest = hashlib.sha1('\n'.join(keys).encode()).hexdigest()
+    return files, keys, digest
+
+def thread_func(file_list, folder_n, n, clusters, keys=None, plan=None, dedup=False):
     to_do_map = {}
     with futures.ThreadPoolExecutor(28) as tpe:
         for idx, item in enumerate(clusters):
@@ -130,14 +380,51 @@ def thread_func(file_list, folder_n, n, clusters):
             type_dir = os.path.join(folder_n, f"type{tpi}")
             mkdirs(type_dir)
             file_path = os.path.join(folder_n, f"type{tpi}", f"{size}_{n}n.csv")
-            future = tpe.submit(one_file, file_list, file_path, aa, n, idx=size)
+            rel_path = os.path.relpath(file_path, folder_n)
+            if plan is not None and rel_path not in plan:
+                continue
+            if plan is None or plan[rel_path] is None:
+                future = tpe.submit(one_file, file_list, file_path, aa, n, idx=size, dedup=dedup)
+            else:
+                future = tpe.submit(update_file, file_list, file_path, aa, n, keys, plan[rel_path])
             to_do_map[future] = tpi, size, cluster
         done_iter = futures.as_completed(to_do_map)
         for i in done_iter:
+            # a failed scheme fails reduce_seq before the manifest is saved
+            i.result()
             print(i)
 
-def reduce_seq(file_list, folder_n, n, cluster_info, p):
+def update_plan(file_list, folder_n, n, cluster_info):
+    """ decide per feature file whether it is up to date, can be spliced or
+    has to be written from scratch, a feature file whose hash differs from the
+    manifest was written by a plain run and is written from scratch
+    :return: manifest, current record keys, digest,
+             plan {relative path: old record keys or None}
+    """
+    manifest = load_manifest(folder_n)
+    files, keys, digest = record_state(file_list, manifest)
+    manifest['files'], manifest['digest'] = files, digest
+    manifest['records'][digest] = keys
+    paths = [os.path.join(f"type{tpi}", f"{size}_{n}n.csv") for tpi, size, _, _ in cluster_info]
+    paths.append(f'20_{n}n.csv')
+    plan = {}
+    for path in paths:
+        state, fea_hash = manifest['schemes'].get(path, (None, None))
+        file_path = os.path.join(folder_n, path)
+        if not os.path.exists(file_path) or file_hash(file_path) != fea_hash:
+            plan[path] = None
+        elif state == digest:
+            continue
+        else:
+            plan[path] = manifest['records'].get(state)
+    return manifest, keys, digest, plan
+
+def reduce_seq(file_list, folder_n, n, cluster_info, p, incremental=False, dedup=False):
     mkdirs(folder_n)
+    keys, plan = None, None
+    if incremental:
+        manifest, keys, digest, plan = update_plan(file_list, folder_n, n, cluster_info)
+        print(f'{n}n --> {len(plan)} feature files to update')
     to_do_map = {}
     cluster_per = []
     counts = len(cluster_info)
@@ -154,22 +441,37 @@ def reduce_seq(file_list, folder_n, n, cluster_info, p):
                 tmp = [tpi, size]
             if idx % per == 0:
                 clusters = cluster_per.copy()
-                future = ppe.submit(thread_func, file_list, folder_n, n, clusters)
+                future = ppe.submit(thread_func, file_list, folder_n, n, clusters,
+                                    keys, plan, dedup)
                 to_do_map[future] = [idx-per, idx]
                 cluster_per.clear()
             cluster_per.append(item)
         else:
-            future = ppe.submit(thread_func, file_list, folder_n, n, cluster_per)
+            future = ppe.submit(thread_func, file_list, folder_n, n, cluster_per,
+                                keys, plan, dedup)
             to_do_map[future] = [idx-per, idx]
-        naa_path = os.path.join(folder_n, f'20_{n}n.csv')
-        future = ppe.submit(one_file, file_list, naa_path, NAA, n)
-        to_do_map[future] = "20s"
+        naa_name = f'20_{n}n.csv'
+        naa_path = os.path.join(folder_n, naa_name)
+        if plan is None or plan.get(naa_name) is None and naa_name in plan:
+            future = ppe.submit(one_file, file_list, naa_path, NAA, n, dedup=dedup)
+            to_do_map[future] = "20s"
+        elif naa_name in plan:
+            future = ppe.submit(update_file, file_list, naa_path, NAA, n, keys, plan[naa_name])
+            to_do_map[future] = "20s"
         done_iter = futures.as_completed(to_do_map)
         for f in done_iter:
+            f.result()
             idx = to_do_map[f]
             print(f'{n}n --> {idx}', 'has done!')
+    if incremental:
+        for path in plan:
+            manifest['schemes'][path] = [digest, file_hash(os.path.join(folder_n, path))]
+        save_manifest(folder_n, manifest)
 
 def dic2array(result_dic, key='acc', filter_num=0, cls=0):
+    """ only full results are scored, proxy scores of schemes pruned by
+    adaptive_eval are nan, so they are plotted as missing and never ranked,
+    but still count toward filter_num like the sizes evaluated in full """
     acc_ls = []  # all type acc
     filtered_type_acc = []
     type_ls = [type_id for type_id in result_dic.keys()]
@@ -183,10 +485,12 @@ def dic2array(result_dic, key='acc', filter_num=0, cls=0):
         type_ = result_dic[ti]
         score_size_ls = []
         for size in range(2, 21):
-            if str(size) in type_:
+            if str(size) not in type_:
+                score = 0
+            elif type_[str(size)].get('fidelity', 'full') == 'full':
                 score = type_[str(size)][key][cls]
             else:
-                score = 0
+                score = np.nan
             score_size_ls.append(score)
         all_score_array[idx] = score_size_ls
         if len(type_) < filter_num:
@@ -201,12 +505,19 @@ def dic2array(result_dic, key='acc', filter_num=0, cls=0):
 def eval_plot(result_dic, n, out, fmt='tiff', filter_num = 8):
     key = 'acc'
     all_score, filter_score = dic2array(result_dic, key=key, filter_num=filter_num)
+    return score_plot(all_score, filter_score, n, out, fmt=fmt, filter_num=filter_num)
+
+def score_plot(all_score, filter_score, n, out, fmt='tiff', filter_num=8, key='acc'):
     scores, types = all_score
     f_scores, f_types = filter_score
     f_heatmap_path = os.path.join(out, f'{key}_f{filter_num}-heatmap_{n}n.{fmt}')
     heatmap_path = os.path.join(out, f'{key}_heatmap_{n}n.{fmt}')
+    if types:
+        draw.p_acc_heat(scores.T, 0.6, 1, types, heatmap_path)
+    if not f_types or np.isnan(f_scores).all():
+        print(f'{n}n --> no type has {filter_num} evaluated sizes, nothing more to plot')
+        return np.zeros(0), None
     draw.p_acc_heat(f_scores.T, 0.6, 1, f_types, f_heatmap_path)
-    draw.p_acc_heat(scores.T, 0.6, 1, types, heatmap_path)
 
     f_scores_arr = f_scores[f_scores > 0]
     size_arr = np.array([np.arange(2, 21)] * f_scores.shape[0])[f_scores > 0]
@@ -214,7 +525,7 @@ def eval_plot(result_dic, n, out, fmt='tiff', filter_num = 8):
     size_arr = size_arr.flatten()
     draw.p_bivariate_density(size_arr, f_scores_arr, n, path)
 
-    max_type_idx_arr, max_size_idx_arr = np.where(f_scores == f_scores.max())
+    max_type_idx_arr, max_size_idx_arr = np.where(f_scores == np.nanmax(f_scores))
     m_type_idx, m_size_idx = max_type_idx_arr[0], max_size_idx_arr[0]  # 默认第一个
 
     cp_path = os.path.join(out, f'comparsion_{n}n.{fmt}')
@@ -259,12 +570,29 @@ def load_normal_data(file_data): ## file for data (x,y)
     x = scaler.fit_transform(x)
     return x, y
 
-def data_to_hpo(file, hpo=1):
+def dedup_data(x, y):
+    """ merge samples with identical features and label into one weighted
+    sample, samples with identical features but different labels are kept
+    apart and counted as conflicts
+    :return: x, y, weight (multiplicity), number of conflicting feature rows
+    """
+    data = np.hstack([y[:, None], x])
+    uniq, counts = np.unique(data, axis=0, return_counts=True)
+    _, feature_counts = np.unique(uniq[:, 1:], axis=0, return_counts=True)
+    conflict = int((feature_counts > 1).sum())
+    return uniq[:, 1:], uniq[:, 0], counts.astype(float), conflict
+
+def data_to_hpo(file, hpo=1, weight=None):
+    """ stratified subsample of a `hpo` fraction for hyper-parameter search
+    :return: x, y, weight of the subsample
+    """
     hpo_x, hpo_y = load_normal_data(file)
-    if hpo < 1:
-        train_x, _, train_y, _ = train_test_split(
-            hpo_x, hpo_y, shuffle=True, random_state=1, test_size=1-hpo)
-    return hpo_x, hpo_y
+    if hpo is not None and hpo < 1:
+        w = np.ones(len(hpo_y)) if weight is None else weight
+        hpo_x, _, hpo_y, _, w, _ = train_test_split(
+            hpo_x, hpo_y, w, shuffle=True, random_state=1, train_size=hpo, stratify=hpo_y)
+        weight = None if weight is None else w
+    return hpo_x, hpo_y, weight
 
 TEXT = """
     敏感度(Sensitivity, SN)也称召回率(Recall, RE):	
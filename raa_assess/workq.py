@@ -0,0 +1,220 @@
+"""
+    :Description:
+        sqlite work queue on a shared path, so that `raa worker` processes
+        on any number of hosts can split a (scheme, k, stage) sweep.
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import traceback
+
+from . import utils as ul
+from . import compute as cp
+from . import store as st
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+def connect(db):
+    conn = sqlite3.connect(db, timeout=60, isolation_level=None)
+    conn.execute('create table if not exists task( \
+                id integer primary key autoincrement, \
+                stage text not null, k int not null, \
+                type text not null, size text not null, \
+                cluster text, path text not null, \
+                status text not null default \'pending\', \
+                worker text, heartbeat real, \
+                tries int not null default 0, result text, \
+                job int not null references job(id))')
+    conn.execute('create table if not exists job( \
+                id integer primary key autoincrement, meta text not null)')
+    conn.execute('create index if not exists task_status on task(status, id)')
+    return conn
+
+def get_meta(conn, job):
+    """ settings of one submission, every task runs with the meta of its own job """
+    row = conn.execute('select meta from job where id=?', (job,)).fetchone()
+    return json.loads(row[0])
+
+def submit(db, file_list, out, k_list, cluster_info, evaluate=False, cv=-1, hpo=1,
+           model='svm', dedup=False, repeat=1):
+    """ add reduce tasks of every scheme and k to the queue
+    :param db: queue database path on the shared filesystem, string
+    :param file_list: fasta files, list
+    :param out: output folder name, features go to `{out}_{n}n`, string
+    :param k_list: k-mer, list
+    :param cluster_info: rows of reduce_query, list
+    :param evaluate: if add an eval task after each reduce task, bool
+    :return: job id, number of added tasks
+    """
+    meta = {'files': [os.path.abspath(f) for f in file_list],
+            'out': os.path.abspath(out), 'evaluate': evaluate,
+            'cv': cv, 'hpo': hpo, 'model': model, 'dedup': dedup, 'repeat': repeat,
+            'run': st.new_run()}
+    conn = connect(db)
+    conn.execute('begin immediate')
+    job = conn.execute('insert into job(meta) values (?)', (json.dumps(meta),)).lastrowid
+    tasks = []
+    for n in k_list:
+        folder_n = f'{meta["out"]}_{n}n'
+        done = set()
+        for tpi, size, cluster, _ in cluster_info:
+            if (tpi, size) in done:
+                continue
+            done.add((tpi, size))
+            path = os.path.join(folder_n, f"type{tpi}", f"{size}_{n}n.csv")
+            tasks.append(('reduce', n, f'type{tpi}', str(size), cluster, path, job))
+        naa_path = os.path.join(folder_n, f'20_{n}n.csv')
+        tasks.append(('reduce', n, 'natural amino acids', '20s', '-'.join(ul.NAA), naa_path,
+                      job))
+    conn.executemany('insert into task(stage, k, type, size, cluster, path, job) \
+                      values (?, ?, ?, ?, ?, ?, ?)', tasks)
+    conn.execute('commit')
+    conn.close()
+    return job, len(tasks)
+
+def claim(conn, worker, timeout, max_tries=3):
+    """ requeue tasks of dead workers, a task that has been tried max_tries
+    times is marked failed like in fail, then take the oldest pending task """
+    now = time.time()
+    conn.execute('begin immediate')
+    try:
+        conn.execute('update task set status=case when tries<? then ? else ? end, \
+                      worker=null, result=? where status=? and heartbeat<?',
+                     (max_tries, PENDING, FAILED, 'worker lost', RUNNING, now - timeout))
+        row = conn.execute('select id, stage, k, type, size, cluster, path, job from task \
+                            where status=? order by id limit 1', (PENDING,)).fetchone()
+        if row is not None:
+            conn.execute('update task set status=?, worker=?, heartbeat=?, tries=tries+1 \
+                          where id=?', (RUNNING, worker, now, row[0]))
+        conn.execute('commit')
+    except Exception:
+        conn.execute('rollback')
+        raise
+    return row
+
+def _beat(db, task_id, worker, interval, stop):
+    conn = sqlite3.connect(db, timeout=60)
+    while not stop.wait(interval):
+        with conn:
+            conn.execute('update task set heartbeat=? where id=? and worker=?',
+                         (time.time(), task_id, worker))
+    conn.close()
+
+def finish(conn, task, worker, meta, result=None):
+    task_id, stage, k, tpi, size, cluster, path, job = task
+    conn.execute('begin immediate')
+    cur = conn.execute('update task set status=?, result=? where id=? and worker=?',
+                       (DONE, result, task_id, worker))
+    # a task requeued while this worker was stalled belongs to someone else now
+    if cur.rowcount and stage == 'reduce' and meta['evaluate']:
+        conn.execute('insert into task(stage, k, type, size, cluster, path, job) \
+                      values (?, ?, ?, ?, ?, ?, ?)', ('eval', k, tpi, size, cluster, path, job))
+    conn.execute('commit')
+
+def fail(conn, task_id, worker, error, max_tries):
+    with conn:
+        conn.execute('update task set status=case when tries<? then ? else ? end, \
+                      worker=null, result=? where id=? and worker=?',
+                     (max_tries, PENDING, FAILED, error, task_id, worker))
+
+def run_task(task, meta):
+    _, stage, k, _, size, cluster, path, _ = task
+    if stage == 'reduce':
+        ul.mkdirs(os.path.dirname(path))
+        aa = [i for i in cluster.split('-') if i]
+        # a stalled worker whose task was requeued may still be writing, each
+        # worker writes its own file and only a complete one replaces path
+        tmp_path = f'{path}.{socket.gethostname()}.{os.getpid()}'
+        ul.one_file(meta['files'], tmp_path, aa, k, idx=size, dedup=meta['dedup'])
+        os.replace(tmp_path, path)
+        return None
+    repeat = meta['repeat']
+    metric, _, elapsed = cp.timed(cp.process_eval_func, path, cv=meta['cv'],
+                                  hpo=meta['hpo'], model=meta['model'], dedup=meta['dedup'],
+                                  repeat=repeat)
+    mode = cp.cv_mode(meta['cv'], repeat)
+    return json.dumps(cp.metric_dic(metric, elapsed, cv=mode, hpo=meta['hpo']))
+
+def run_worker(db, interval=30, timeout=300, max_tries=3):
+    """ claim and run tasks until the queue is drained
+    :param db: queue database path, string
+    :param interval: heartbeat and polling interval in seconds, int
+    :param timeout: a running task without heartbeat for timeout seconds is requeued, int
+    :param max_tries: a task failing max_tries times is marked failed, int
+    :return:
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    conn = connect(db)
+    metas = {}
+    while True:
+        task = claim(conn, worker, timeout, max_tries)
+        if task is None:
+            left = conn.execute('select count(*) from task where status in (?, ?)',
+                                (PENDING, RUNNING)).fetchone()[0]
+            if not left:
+                break
+            time.sleep(interval)
+            continue
+        # jobs never change after submit, so their meta can be cached
+        if task[7] not in metas:
+            metas[task[7]] = get_meta(conn, task[7])
+        meta = metas[task[7]]
+        stop = threading.Event()
+        beat = threading.Thread(target=_beat, args=(db, task[0], worker, interval, stop),
+                                daemon=True)
+        beat.start()
+        try:
+            result = run_task(task, meta)
+        except Exception:
+            fail(conn, task[0], worker, traceback.format_exc(), max_tries)
+            print(f'{worker} --> {task[1]} {task[3]} {task[4]} {task[2]}n', 'has failed!')
+        else:
+            finish(conn, task, worker, meta, result)
+            print(f'{worker} --> {task[1]} {task[3]} {task[4]} {task[2]}n', 'has done!')
+        finally:
+            stop.set()
+            beat.join()
+    for job in metas:
+        if metas[job]['evaluate']:
+            collect(conn, job)
+    conn.close()
+
+def jobs(conn):
+    return [row[0] for row in conn.execute('select id from job order by id')]
+
+def collect(conn, job):
+    """ write `{out}/{n}n_result.json` and the result store from the finished
+    eval tasks of a job """
+    meta = get_meta(conn, job)
+    out = meta['out']
+    ul.mkdirs(out)
+    rows = conn.execute('select k, type, size, result from task \
+                         where stage=? and status=? and job=?', ('eval', DONE, job)).fetchall()
+    result = {}
+    for k, tpi, size, one_dic in rows:
+        result.setdefault(k, [{}, None])
+        if size == '20s':
+            result[k][1] = json.loads(one_dic)
+        else:
+            result[k][0].setdefault(tpi, {})[size] = json.loads(one_dic)
+    for k, (result_dic, naa_dic) in result.items():
+        json_path = os.path.join(out, f'{k}n_result.json')
+        tmp_path = f'{json_path}.{socket.gethostname()}.{os.getpid()}'
+        cp.write_result(result_dic, naa_dic, tmp_path)
+        os.replace(tmp_path, json_path)
+        with open(json_path, 'r') as f:
+            result_dic = json.load(f)
+        st.save(os.path.join(out, 'result.db'), result_dic, k, run=meta['run'],
+                classifier=meta['model'], cv=cp.cv_mode(meta['cv'], meta['repeat']),
+                hpo=meta['hpo'])
+
+def status(db):
+    conn = connect(db)
+    rows = conn.execute('select job, stage, status, count(*) from task \
+                         group by job, stage, status order by job, stage, status').fetchall()
+    conn.close()
+    return rows
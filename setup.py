@@ -11,7 +11,7 @@ setup(name='raa_assess',
     install_requires=[
         'numpy>=1.16.2',
         'matplotlib>=3.0.3',
-        'scikit-learn>=0.21.2',
+        'scikit-learn>=0.24',
         'seaborn>=0.9.0',
         
         ],
@@ -20,6 +20,6 @@ setup(name='raa_assess',
         'raa=raa_assess.__main__:command_parser',
             ]
         },
-    python_requires=">=3.5",
+    python_requires=">=3.8",
     include_package_data=True,
     zip_safe=True)
\ No newline at end of file